@@ -0,0 +1,52 @@
+import atexit
+import asyncio
+import logging
+from playwright.async_api import async_playwright
+
+# Playwright objects are tied to the event loop they were created on, so all browser work runs on this one loop:
+_loop = None
+_lock = None
+_playwright = None
+_browser = None
+
+def run(coro):
+    """Runs a coroutine on the event loop shared by the pooled browser"""
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        atexit.register(_shutdown)
+    return _loop.run_until_complete(coro)
+
+async def get_browser():
+    """Returns the pooled browser, launching it the first time it is needed"""
+    global _lock, _playwright, _browser
+    if _lock is None:
+        _lock = asyncio.Lock()
+    # Hold the lock so concurrent callers don't launch a browser each:
+    async with _lock:
+        if _playwright is None:
+            _playwright = await async_playwright().start()
+        if _browser is None:
+            logging.info("Launching browser")
+            _browser = await _playwright.chromium.launch(args=['--ignore-certificate-errors'])
+        return _browser
+
+async def new_context(proxy, **kwargs):
+    """Creates a fresh browser context that uses the given proxy. Callers should close the context when done with it."""
+    browser = await get_browser()
+    # Setting the proxy per context means one browser can serve any proxy:
+    return await browser.new_context(proxy={'server': proxy}, ignore_https_errors=True, **kwargs)
+
+async def close():
+    """Closes the pooled browser and stops Playwright"""
+    global _playwright, _browser
+    if _browser is not None:
+        await _browser.close()
+        _browser = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+
+def _shutdown():
+    _loop.run_until_complete(close())
+    _loop.close()
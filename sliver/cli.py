@@ -1,20 +1,269 @@
+import io
 import os
+import re
+import sys
+import asyncio
+import json
 import time
-import yaml
+import socket
+import hashlib
+import itertools
 import click
 import logging
 import tempfile
+import subprocess
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pywb.apps.cli import WaybackCli
-from shot_scraper.cli import multi
-from shot_scraper.utils import filename_for_url
+from pywb.warcserver.http import PywbHttpAdapter, DefaultAdapters
+from warcio.timeutils import timestamp_to_http_date
+# Import after pywb, so the gevent monkey-patching applies to the connection pool and browser driver:
+import urllib3
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ProtocolError, ReadTimeoutError
+from playwright.async_api import Error as PlaywrightError
+from sliver import browser_pool
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(filename)s - %(levelname)s - %(message)s'
 )
 
+_disallowed_re = re.compile("[^a-zA-Z0-9_-]")
+
+def _filename_for_url(url):
+    """Names the screenshot for a URL after its host, plus a hash of the whole URL so different URLs never share a file"""
+    parts = url.split('/', 3)
+    host = parts[2] if len(parts) > 2 else ''
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()
+    return f"{_disallowed_re.sub('', host.replace('.', '-'))}-{digest}.png"
+
+def make_http_pool(maxsize):
+    """Creates a pool of HTTP connections that asks for compressed responses, and retries requests that hang or get rate-limited or server errors, with backoff"""
+    return urllib3.PoolManager(
+        maxsize=maxsize,
+        headers={'Accept-Encoding': 'gzip'},
+        retries=Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504), respect_retry_after_header=True),
+        timeout=urllib3.Timeout(connect=5, read=30))
+
+# Shared pool of HTTP connections, so repeated queries re-use connections:
+http_pool = make_http_pool(8)
+
+def iter_lines(response, chunk_size=65536):
+    """Splits a streamed HTTP response into lines, reading it in large chunks"""
+    # Use a single buffer that is trimmed in place, rather than copying the remaining bytes for every line:
+    buf = bytearray()
+    for chunk in response.stream(chunk_size, decode_content=True):
+        buf.extend(chunk)
+        start = 0
+        while (nl := buf.find(b'\n', start)) != -1:
+            yield bytes(buf[start:nl])
+            start = nl + 1
+        del buf[:start]
+    if buf:
+        yield bytes(buf)
+
+def fetch_cdx_page(url, params, output, batch_size=65536, attempts=3, pool=http_pool):
+    """Runs a single CDX query, writing the results to the binary output and returning the resume key (if any)"""
+    # Count the rows written, so if the response gets cut off the query can be re-run, skipping the rows already written:
+    written = 0
+    for attempt in range(1, attempts + 1):
+        # Gather the lines up and write them out in large batches:
+        batch = bytearray()
+        try:
+            response = pool.request('GET', url, fields=params, preload_content=False, decode_content=True)
+        except MaxRetryError as e:
+            raise click.ClickException(f"CDX query failed: {e.reason}")
+        try:
+            if response.status != 200:
+                raise click.ClickException(f"CDX query failed with HTTP status {response.status}")
+            lines = iter_lines(response)
+            # The results run up to the first blank line:
+            for line in itertools.islice(lines, written, None):
+                cdx = line.strip()
+                if not cdx:
+                    break
+                # FIXME filter our lines that are not under the supplied path prefix (i.e. cope with host-level matching of the CC indexes)
+                batch += cdx
+                batch += b"\n"
+                written += 1
+                if len(batch) > batch_size:
+                    output.write(batch)
+                    batch.clear()
+            # And the line after that holds the resume key, if there is one:
+            return next(lines, b"").strip().decode('utf-8') or None
+        except (ReadTimeoutError, ProtocolError) as e:
+            if attempt == attempts:
+                raise click.ClickException(f"CDX query failed after {attempts} attempts: {e}")
+            logging.warning(f"CDX query interrupted ({e}), retrying from row {written}...")
+        finally:
+            response.release_conn()
+            output.write(batch)
+            output.flush()
+
+def count_cdx_pages(url, params):
+    """Asks the CDX server how many pages of results there are for a query"""
+    try:
+        response = http_pool.request('GET', url, fields={**params, 'showNumPages': True})
+    except MaxRetryError as e:
+        raise click.ClickException(f"CDX page count query failed: {e.reason}")
+    if response.status != 200:
+        raise click.ClickException(f"CDX page count query failed with HTTP status {response.status}")
+    body = response.data.decode('utf-8').strip()
+    # IA returns a plain number, but pywb-based servers like Common Crawl's return JSON:
+    if body.isdigit():
+        return int(body)
+    try:
+        return int(json.loads(body)['pages'])
+    except (ValueError, KeyError, TypeError):
+        raise click.ClickException(f"CDX page count query returned an unexpected response: {body[:100]}")
+
+def fetch_cdx_pages(url, params, pages, workers, output):
+    """Fetches numbered pages of CDX results in parallel, writing them to output in page order"""
+    # Use a pool with enough connections for every worker to re-use its own:
+    pool = make_http_pool(workers)
+
+    def fetch_page(page):
+        buffer = io.BytesIO()
+        fetch_cdx_page(url, {**params, 'page': page}, buffer, pool=pool)
+        return buffer.getvalue()
+
+    with pool, ThreadPoolExecutor(max_workers=workers) as executor:
+        # Results come back in submission order, so each page is written out as soon as it and the ones before it are done:
+        for text in executor.map(fetch_page, range(pages)):
+            output.write(text)
+
+async def take_screenshots(shots, proxy, timestamp, concurrency):
+    """Takes the screenshots using the pooled browser, with a separate context for each URL so they can run concurrently"""
+    # Ask the proxy for the target timestamp on every request, so this works with a proxy that is already running:
+    headers = {'Accept-Datetime': timestamp_to_http_date(timestamp)}
+    # Chromium serializes screenshots within a browser, so only let a couple queue up at once:
+    capturing = asyncio.Semaphore(2)
+
+    async def take_screenshot(url, output, wait, width, height):
+        context = None
+        try:
+            context = await browser_pool.new_context(proxy, extra_http_headers=headers, viewport={'width': width, 'height': height})
+            page = await context.new_page()
+            await page.goto(url, timeout=60_000)
+            await page.wait_for_timeout(wait)
+            async with capturing:
+                await page.screenshot(path=output)
+            logging.info(f"Screenshot of '{url}' written to '{output}'")
+        except PlaywrightError as e:
+            logging.error(f"Failed to take screenshot of '{url}': {e}")
+        finally:
+            if context is not None:
+                await context.close()
+
+    # Each worker pulls the next shot as it becomes free, so the shots are only read in as they are needed:
+    shots = iter(shots)
+    async def worker():
+        for shot in shots:
+            await take_screenshot(**shot)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+def existing_screenshots(path):
+    """Lists the names of the non-empty screenshots that have already been taken"""
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries if entry.is_file() and entry.stat().st_size > 0}
+
+def iter_shots(url_file, wait, width, height, skip=frozenset()):
+    """Reads the URLs from the file, and generates the screenshot to take for each new one, unless its filename is in skip"""
+    seen = set()
+    for url in url_file:
+        url = url.strip()
+        if url and not url.startswith("#") and url not in seen:
+            seen.add(url)
+            filename = _filename_for_url(url)
+            if filename in skip:
+                logging.info(f"Skipping '{url}' as '{filename}' already exists.")
+                continue
+            yield {
+                'url': url,
+                'output': f'collections/mementos/screenshots/{filename}',
+                'wait': wait,
+                'width':  width,
+                'height': height,
+                # FIXME: Example of how to run some JavaScript on the page before taking the screenshot. Needs integrating with CLI options.
+                #'javascript': 'document.body.style.margin = 0;',
+            }
+
+def run_screenshot_processes(shots, processes, fetch_args):
+    """Splits the shots between several 'sliver fetch' processes, each with its own browser, all using the running proxy"""
+    with tempfile.TemporaryDirectory(prefix="sliver-") as tmp:
+        # Deal the URLs out to a file for each process:
+        paths = [os.path.join(tmp, f"urls-{i}.txt") for i in range(processes)]
+        files = [open(path, 'w') for path in paths]
+        for i, shot in enumerate(shots):
+            files[i % processes].write(shot['url'] + "\n")
+        for file in files:
+            file.close()
+        # Chromium serializes screenshots within a browser, so running a browser per process lets them happen in parallel.
+        # The shots have already been checked, so the processes don't need to skip existing screenshots again:
+        procs = [subprocess.Popen([sys.executable, '-m', 'sliver.cli', 'fetch', '--force', '--parent-proxy', *fetch_args, path]) for path in paths]
+        failed = sum(proc.wait() != 0 for proc in procs)
+    if failed:
+        raise click.ClickException(f"{failed} of the {processes} screenshot processes failed.")
+
+def is_listening(port):
+    """Checks if something is accepting connections on the given local port"""
+    try:
+        with socket.create_connection(('localhost', port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+def is_pywb_proxy(port):
+    """Checks if the server on the given local port is a pywb proxy, by asking it for the wombat.js it serves from its special proxy host"""
+    try:
+        with urllib3.ProxyManager(f'http://localhost:{port}', retries=False, timeout=urllib3.Timeout(connect=2, read=5)) as proxy:
+            response = proxy.request('GET', 'http://pywb.proxy/static/wombat.js', preload_content=False)
+            try:
+                return response.status == 200 and b'Wombat' in response.read(256)
+            finally:
+                response.release_conn()
+    except urllib3.exceptions.HTTPError:
+        return False
+
+def make_collection_folders():
+    """Sets up the folders the archiving proxy and screenshots are stored in"""
+    os.makedirs('collections/mementos/indexes', exist_ok=True)
+    os.makedirs('collections/mementos/archive', exist_ok=True)
+    os.makedirs('collections/mementos/screenshots', exist_ok=True)
+
+# The parts of the pywb configuration that do not depend on the command-line options:
+_BASE_CONFIG = {
+    'recorder': {
+        'source_coll': 'stack', 
+        'source_filter': 'source', 
+        'filename_template': 'SLIVER-{timestamp}-{random}.warc.gz'
+    }, 
+    'autoindex': 10, 
+    'enable_auto_fetch': True,
+    'enable_wombat': True
+}
+
+_COLLECTIONS = {
+    'ia': 'memento+https://web.archive.org/web/',
+    'ia_cdx': 'cdx+https://web.archive.org/cdx /web',
+    'live': { 'index': '$live'},
+}
+
+_STACK_LIVE = [{'name': 'source', 'index': '$live'}]
+
+_STACK_ARCHIVE = [
+    {
+        'archive_paths': './collections/mementos/archive/',
+        'index_paths': './collections/mementos/indexes',
+        'name': 'mementos'
+    },
+    {
+        'index': 'memento+https://web.archive.org/web/',
+        'name': 'source'
+    }]
+
 class EmbeddedWaybackCli(WaybackCli):
     """CLI class for starting the pywb's implementation of the Wayback Machine in an embedded mode"""
    
@@ -39,48 +288,32 @@ class EmbeddedWaybackCli(WaybackCli):
         parser.add_argument(
             '--timestamp', default='19950101000000',
             help="Target timestamp to use for the proxy requests")
+        # Add the connection pool size option:
+        parser.add_argument(
+            '--pool-size', type=int, default=10,
+            help="Number of connections to keep open to each remote host")
 
     def load(self):
-        # Set up the extra_config:
+        # Set up the extra_config, creating fresh 'collections' and 'proxy' dicts as pywb updates them in place:
         self.extra_config = {
+            **_BASE_CONFIG,
             'collections': {
-                'ia': 'memento+https://web.archive.org/web/',
-                'ia_cdx': 'cdx+https://web.archive.org/cdx /web',
-                'live': { 'index': '$live'},
+                **_COLLECTIONS,
                 'stack': {
-                    'sequence': []
+                    # Stacking not required for live web fetches, otherwise stack the local and remote archive:
+                    'sequence': _STACK_LIVE if self.r.source == 'live' else _STACK_ARCHIVE
                 }
-            }, 
-            'recorder': {
-                'source_coll': 'stack', 
-                'source_filter': 'source', 
-                'filename_template': 'SLIVER-{timestamp}-{random}.warc.gz'
-            }, 
+            },
             'proxy': {
                 'coll': 'mementos', 
                 'recording': True, 
                 'default_timestamp': self.r.timestamp
-            }, 
-            'autoindex': 10, 
-            'enable_auto_fetch': True,
-            'enable_wombat': True
+            }
         }
-        
-        # Stacking not required for live web fetches:
-        if self.r.source == 'live':
-            self.extra_config['collections']['stack']['sequence']= [{'name': 'source', 'index': '$live'}]
-        else:
-            # Stack the sources so we can fetch from the local and remote archive:
-            self.extra_config['collections']['stack']['sequence'] = [
-                {
-                    'archive_paths': './collections/mementos/archive/',
-                    'index_paths': './collections/mementos/indexes',
-                    'name': 'mementos'
-                },
-                {
-                    'index': 'memento+https://web.archive.org/web/',
-                    'name': 'source'
-                }]
+
+        # Keep enough connections open to the remote hosts to serve all the requests the browser makes at once:
+        DefaultAdapters.live_adapter = PywbHttpAdapter(max_retries=Retry(3), pool_maxsize=self.r.pool_size)
+        DefaultAdapters.remote_adapter = PywbHttpAdapter(max_retries=Retry(3), pool_maxsize=self.r.pool_size)
 
         # Do the superclass setup:
         app = super(EmbeddedWaybackCli, self).load()        
@@ -97,6 +330,14 @@ class EmbeddedWaybackCli(WaybackCli):
                           handler_class=RequestURIWSGIHandler,
                           direct=False)
 
+    def wait_until_ready(self):
+        """Waits until the embedded server accepts connections, backing off between attempts"""
+        for delay in (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0):
+            if is_listening(self.r.port):
+                return
+            time.sleep(delay)
+        raise click.ClickException(f"PyWB did not start listening on port {self.r.port}")
+
 
 @click.group()
 def cli():
@@ -108,8 +349,10 @@ def cli():
 @click.option('-L', '--limit', type=int, default=10_000, help="Limit the number of results returned.", show_default=True)
 @click.option('-f', '--filter', type=str, default="statuscode:[23]..", help="Filter to apply to the results. Default value only returns HTTP 2XX or 3XX records.", show_default=True)
 @click.option('-r', '--resume-key', type=str, help="Resume key to use for the query.")
-@click.option('-o', '--output', type=click.File('w'), default="-", help="Output file to write the results to, in CDX format. Default writes to <STDOUT>.", show_default=True)
-def lookup(url, source, limit, filter, resume_key, output):
+@click.option('-n', '--pages', type=int, help="Maximum number of pages of results to fetch. With one worker, each page is followed on from the last using the resume key, and only one page is fetched by default. With more workers, numbered pages are fetched, and all of them by default.")
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=1, help="Number of pages to fetch in parallel. Values above 1 use the numbered-page CDX API rather than resume keys.", show_default=True)
+@click.option('-o', '--output', type=click.File('wb'), default="-", help="Output file to write the results to, in CDX format. Default writes to <STDOUT>.", show_default=True)
+def lookup(url, source, limit, filter, resume_key, pages, workers, output):
     """
     Looks up URLs based on a URL prefix.
 
@@ -139,29 +382,33 @@ def lookup(url, source, limit, filter, resume_key, output):
     }
     if filter is not None:
         params["filter"] = filter
+
+    if workers > 1:
+        # Resume keys can only be followed one after another, so use numbered pages to fetch in parallel:
+        if resume_key is not None:
+            raise click.UsageError("The --resume-key option cannot be used with more than one worker.")
+        del params["showResumeKey"]
+        # Each numbered page would be cut off at the limit with no way to resume, so fetch whole pages instead:
+        del params["limit"]
+        if click.get_current_context().get_parameter_source('limit') != click.core.ParameterSource.DEFAULT:
+            logging.warning("The --limit option is ignored when using more than one worker, as whole pages are fetched.")
+        total = count_cdx_pages(URL, params)
+        pages = total if pages is None else min(pages, total)
+        logging.info(f"Fetching {pages} of {total} pages using {workers} workers.")
+        fetch_cdx_pages(URL, params, pages, workers, output)
+        return
+
+    # Fetch each page in turn, using the resume key from the previous page:
+    for page in range(pages or 1):
+        if resume_key is not None:
+            params["resumeKey"] = resume_key
+        logging.info(f"Full URL: {URL}?{urllib.parse.urlencode(params)}")
+        resume_key = fetch_cdx_page(URL, params, output)
+        if resume_key is None:
+            break
+
     if resume_key is not None:
-        params["resumeKey"] = resume_key
-
-    # Build the query string:
-    query_string = urllib.parse.urlencode(params)
-    full_url = f"{URL}?{query_string}"
-    logging.info(f"Full URL: {full_url}")
-    resumeKey = None
-    ended = False
-    with urllib.request.urlopen(full_url) as response:
-        for line in response:
-            if not ended:
-                cdx = line.decode('utf-8').strip()
-                if cdx == "":
-                    ended = True
-                else:
-                    # FIXME filter our lines that are not under the supplied path prefix (i.e. cope with host-level matching of the CC indexes)
-                    click.echo(cdx, output)
-            elif resumeKey is None:
-                resumeKey = line.decode('utf-8').strip()
-
-    if resumeKey is not None:
-        logging.warning(f"Use the following resume key for the next query: {resumeKey}")
+        logging.warning(f"Use the following resume key for the next query: {resume_key}")
 
 @click.command()
 @click.argument("url-file", type=click.File('r'))
@@ -170,74 +417,83 @@ def lookup(url, source, limit, filter, resume_key, output):
 @click.option('-W', '--wait', type=int, default=15_000, help="Time to wait before taking a screenshot, in milliseconds.", show_default=True)
 @click.option('-w', '--width', type=int, default=800, help="Width of the browser window.", show_default=True)
 @click.option('-h', '--height', type=int, default=800, help="Height of the browser window.", show_default=True)
-@click.option('-p', '--padding', type=int, default=0, help="Override default browser window padding. Use 0 for no padding.")
+@click.option('-c', '--concurrency', type=click.IntRange(min=1), default=min(os.cpu_count() or 1, 8), help="Number of URLs to load in the browser at the same time.", show_default=True)
 @click.option('-P', '--proxy-port', type=int, default=8080, help="Port to use for the pywb archiving proxy server.", show_default=True)
-#@click.option('-b', '--browser', type=str, help="Browser to use for the screenshots. If unspecified, uses shot-scraper default.")
-def fetch(url_file, source, timestamp, wait, width, height, padding, proxy_port):
+@click.option('-j', '--processes', type=click.IntRange(min=1), default=1, help="Number of browser processes to take screenshots with, each loading --concurrency URLs at a time.", show_default=True)
+@click.option('-F', '--force', is_flag=True, help="Take screenshots of all the URLs, even if a screenshot already exists.")
+# Used by the screenshot processes, which use the proxy their parent 'sliver fetch' started:
+@click.option('--parent-proxy', is_flag=True, hidden=True)
+#@click.option('-b', '--browser', type=str, help="Browser to use for the screenshots. If unspecified, uses Chromium.")
+def fetch(url_file, source, timestamp, wait, width, height, concurrency, proxy_port, processes, force, parent_proxy):
     """
     Fetches archives and screenshots a set of URLs.
     
     URL_FILE: a plain test file with one URL per line.
     """
     # Set up the required folders for this to work:
-    os.makedirs('collections/mementos/indexes', exist_ok=True)
-    os.makedirs('collections/mementos/archive', exist_ok=True)
-    os.makedirs('collections/mementos/screenshots', exist_ok=True)
-    # Start PyWB with the appropriate source configuration. Threads throttles to reduce load on remote servers:
-    embedded = EmbeddedWaybackCli(args=['--source', source, '--threads', '2'], default_port=proxy_port)
-    embedded.run()
-    logging.info("PyWB started...")
-    # Give PyWB a little moment to start up:
-    time.sleep(3)
-
-    # Loop through the supplied URLs and check if we need to fetch them, building up a config file:
-    shots = []
-    for url in url_file:
-        url = url.strip()
-        if url and not url.startswith("#"):
-            shot = {
-                'url': url,
-                'output': f'collections/mementos/screenshots/{filename_for_url(url)}',
-                'wait': wait,
-                'width':  width,
-                'height': height,
-                'padding': padding,
-                # FIXME: Example of how to run some JavaScript on the page before taking the screenshot. Needs integrating with CLI options.
-                #'javascript': 'document.body.style.margin = 0;',
-            }
-            # And add it:
-            shots.append(shot)
+    make_collection_folders()
+    # Use the proxy if one is already running (e.g. via 'sliver serve'), otherwise start one up:
+    embedded = None
+    if parent_proxy:
+        # The parent 'sliver fetch' has already started or checked the proxy:
+        logging.info(f"Using the PyWB proxy on port {proxy_port} from the parent process.")
+    elif is_listening(proxy_port):
+        if not is_pywb_proxy(proxy_port):
+            raise click.ClickException(f"Port {proxy_port} is in use by something other than a PyWB proxy. Use --proxy-port to pick another port.")
+        logging.warning(f"Using the PyWB proxy already running on port {proxy_port}. Its source will be used, rather than '{source}'.")
+    else:
+        # Start PyWB with the appropriate source configuration. Threads throttles to reduce load on remote servers:
+        embedded = EmbeddedWaybackCli(args=['--source', source, '--timestamp', timestamp, '--threads', '2', '--pool-size', str(concurrency * processes * 2)], default_port=proxy_port)
+        embedded.run()
+        # Wait for PyWB to start up:
+        embedded.wait_until_ready()
+        logging.info("PyWB started...")
 
-    # Run the screen shot code on the URL, with the right proxy settings:
-    # Can add ['-b', 'chrome'] to force a particular browser to be used.
-    # You then might need to run `playwright install chrome` or similar.
+    # Unless forced, skip any URLs that already have screenshots, so interrupted runs can be resumed:
+    skip = frozenset() if force else existing_screenshots('collections/mementos/screenshots')
 
-    # Set the proxy timestamp:
-    # Need to run each screenshot separately if we want to restart with a new timestamp in the proxy.
-    # But, because of the way it works, gathering multiple timestamps will probably not do what you want.
+    # Run the screenshots with the browser going through the proxy, reading the URLs in as they are needed.
+    # Each page asks the proxy for the target timestamp, but gathering multiple timestamps will probably not do what you want.
     # So may be best to use different collections for different timestamps.
-    embedded.application.proxy_default_timestamp = timestamp
-
-    with tempfile.NamedTemporaryFile(mode="w", prefix="shots-", suffix=".yaml", delete=False) as fp:
-            # Write the shots to a file that will get removed after the screenshot code has run:
-            yaml.dump(shots, fp)
-            fp.close()
-
-            # Run the screenshot code with the shots file:
-            multi( [ 
-                '--browser-arg', '--ignore-certificate-errors', 
-                '--browser-arg', f'--proxy-server=http://localhost:{proxy_port}', 
-                '--timeout', '60000', 
-                fp.name] )
-    
-    # Shutdown PyWB:
-    embedded.ge.stop()
-    logging.info("PyWB stopped.")
+    shots = iter_shots(url_file, wait, width, height, skip)
+    if processes > 1:
+        fetch_args = ['-s', source, '-P', proxy_port, '-t', timestamp, '-W', wait, '-w', width, '-h', height, '-c', concurrency]
+        run_screenshot_processes(shots, processes, [str(arg) for arg in fetch_args])
+    else:
+        browser_pool.run(take_screenshots(shots, f'http://localhost:{proxy_port}', timestamp, concurrency))
+
+    # Shutdown PyWB, if we started it:
+    if embedded is not None:
+        embedded.ge.stop()
+        logging.info("PyWB stopped.")
+
+@click.command()
+@click.option('-s', '--source', type=click.Choice(['live', 'ia']), default="live", help='Source to gather web resources from.', show_default=True)
+@click.option('-t', '--timestamp', type=str, default="19950101000000", help="Default target timestamp to use when gathering records from web archives, 14-digit 'YYYYMMDDHHMMSS' format.", show_default=True)
+@click.option('-c', '--concurrency', type=click.IntRange(min=1), default=min(os.cpu_count() or 1, 8), help="Number of pages expected to be loaded through the proxy at the same time.", show_default=True)
+@click.option('-P', '--proxy-port', type=int, default=8080, help="Port to use for the pywb archiving proxy server.", show_default=True)
+def serve(source, timestamp, concurrency, proxy_port):
+    """
+    Runs the archiving proxy until interrupted.
+
+    Any browser using the proxy will have what it loads recorded, and 'sliver fetch' will use it rather than starting a proxy of its own.
+    """
+    make_collection_folders()
+    embedded = EmbeddedWaybackCli(args=['--source', source, '--timestamp', timestamp, '--threads', '2', '--pool-size', str(concurrency * 2)], default_port=proxy_port)
+    embedded.run()
+    embedded.wait_until_ready()
+    logging.info(f"PyWB proxy running on port {proxy_port}. Press Ctrl-C to stop.")
+    try:
+        embedded.ge.join()
+    except KeyboardInterrupt:
+        embedded.ge.stop()
+        logging.info("PyWB stopped.")
 
 
 
 cli.add_command(lookup)
 cli.add_command(fetch)
+cli.add_command(serve)
 
 if __name__ == "__main__":
     cli()